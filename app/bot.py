@@ -18,21 +18,32 @@ from __future__ import annotations
 
 import asyncio
 import os
-from collections import defaultdict
+import random
 from contextlib import asynccontextmanager
 from datetime import date, datetime, timedelta
-from typing import List
+from itertools import groupby
+from operator import attrgetter
+from typing import Awaitable, Callable, List, TypeVar
 
 from aiogram import Bot, Dispatcher, Router, types
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
 from aiogram.enums import ParseMode
 from aiogram.filters import Command, CommandStart
+from aiogram.methods import TelegramMethod
 from aiogram.utils.keyboard import InlineKeyboardBuilder
+from aiolimiter import AsyncLimiter
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from cachetools import TTLCache
-from sqlalchemy import select
+from cachetools import TLRUCache, TTLCache
+from sqlalchemy import func, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
+from sqlalchemy.orm import selectinload
 
 # local modules
+from services.fetcher_parser import close_http_client, shutdown_parse_pool
+from services.google_sheets_import import close_client as close_sheets_client
+from services.schedule_cache import format_day
 from services.fetcher_parser import sync as fetcher_sync
 from db import models  # assumes models package created via Alembic‑ready code‑gen
 
@@ -49,7 +60,14 @@ DB_URL: str = os.environ.get("DB_URL", "sqlite+aiosqlite:///schedule.db")
 # ---------------------------------------------------------------------------
 # Database helpers ----------------------------------------------------------
 # ---------------------------------------------------------------------------
-engine = create_async_engine(DB_URL, echo=False, pool_pre_ping=True, future=True)
+# SQLite (default) effectively works over a single connection; only size the
+# pool for a real server DB so burst handlers don't queue on checkout.
+_POOL_KWARGS: dict = (
+    {"pool_size": 20, "max_overflow": 10, "pool_recycle": 1800}
+    if DB_URL.startswith("postgresql")
+    else {}
+)
+engine = create_async_engine(DB_URL, echo=False, pool_pre_ping=False, future=True, **_POOL_KWARGS)
 SessionMaker = async_sessionmaker(engine, expire_on_commit=False)
 
 
@@ -68,53 +86,144 @@ async def get_session() -> AsyncSession:  # noqa: D401
 # ---------------------------------------------------------------------------
 # Caching layer -------------------------------------------------------------
 # ---------------------------------------------------------------------------
-# Cache key: (group_id, day ISO) → "formatted schedule markdown"
-DAY_CACHE = TTLCache(maxsize=2048, ttl=60 * 15)  # 15 мин
-WEEK_CACHE = TTLCache(maxsize=1024, ttl=60 * 30)  # 30 мин
+TG_MESSAGE_LIMIT = 4096  # max chars in one Telegram message
+CACHE_TTL_JITTER = 60  # ± сек, чтобы записи не истекали одновременно
+
+
+def _jittered_ttu(ttl: int):
+    """TLRUCache expiry callback: ``ttl`` ± CACHE_TTL_JITTER seconds per entry."""
+
+    def ttu(_key, _value, now: float) -> float:
+        return now + ttl + random.uniform(-CACHE_TTL_JITTER, CACHE_TTL_JITTER)
+
+    return ttu
+
+
+# Cache key: (group_id, date.toordinal()) → "formatted schedule markdown"
+DAY_CACHE = TLRUCache(maxsize=2048, ttu=_jittered_ttu(60 * 15))  # ~15 мин
+# Week: (group_id, monday.toordinal()) → message chunks, ready to send as is
+WEEK_CACHE = TLRUCache(maxsize=1024, ttu=_jittered_ttu(60 * 30))  # ~30 мин
+
+# user_id → active group_id; updated by cb_set_group
+USER_GROUP_CACHE: TTLCache = TTLCache(maxsize=100_000, ttl=60 * 60)
+
+T = TypeVar("T")
+
+# In-flight cache fills: concurrent misses on one key share a single DB query.
+_INFLIGHT: dict[tuple, asyncio.Task] = {}
+
+
+async def _single_flight(key: tuple, load: Callable[[], Awaitable[T]]) -> T:
+    task = _INFLIGHT.get(key)
+    if task is None:
+        task = asyncio.create_task(load())
+        _INFLIGHT[key] = task
+        task.add_done_callback(lambda _t: _INFLIGHT.pop(key, None))
+    return await asyncio.shield(task)
 
 
 # ---------------------------------------------------------------------------
 # Helpers -------------------------------------------------------------------
 # ---------------------------------------------------------------------------
+def _split_message(text: str, limit: int = TG_MESSAGE_LIMIT) -> List[str]:
+    """Split text into Telegram-sized chunks on line boundaries (Markdown stays intact).
+
+    A single line longer than ``limit`` is hard-split at the limit.
+    """
+    if len(text) <= limit:
+        return [text]
+    chunks: List[str] = []
+    current = ""
+    pieces = (
+        line[i : i + limit]
+        for line in text.split("\n")
+        for i in range(0, max(len(line), 1), limit)
+    )
+    for line in pieces:
+        candidate = f"{current}\n{line}" if current else line
+        if len(candidate) > limit and current:
+            chunks.append(current)
+            current = line
+        else:
+            current = candidate
+    if current:
+        chunks.append(current)
+    return chunks
+
+
 async def _markdown_schedule_for_day(group_id: int, when: date) -> str:
-    key = (group_id, when.isoformat())
+    key = (group_id, when.toordinal())
     if key in DAY_CACHE:
         return DAY_CACHE[key]
+    return await _single_flight(("day", *key), lambda: _load_day(group_id, when))
+
+
+async def _load_lessons(db: AsyncSession, group_id: int, days: List[date]) -> dict[date, List[models.Lesson]]:
+    """Live lessons query — fallback for days without a ``schedule_cache`` row."""
+    q = (
+        select(models.Lesson)
+        .options(selectinload(models.Lesson.teacher), selectinload(models.Lesson.room))
+        .where(models.Lesson.group_id == group_id, models.Lesson.date.in_(days))
+        .order_by(models.Lesson.date, models.Lesson.start_time)
+    )
+    res = await db.scalars(q)
+    return {d: list(items) for d, items in groupby(res.all(), key=attrgetter("date"))}
+
+
+async def _load_day(group_id: int, when: date) -> str:
     async with get_session() as db:
-        q = (
-            select(models.Lesson)
-            .where(models.Lesson.group_id == group_id, models.Lesson.date == when)
-            .order_by(models.Lesson.start_time)
+        text = await db.scalar(
+            select(models.ScheduleCache.text).where(
+                models.ScheduleCache.group_id == group_id, models.ScheduleCache.day == when
+            )
         )
-        res = await db.scalars(q)
-        lessons: List[models.Lesson] = res.all()
-    if not lessons:
-        text = "📅 На {:%d.%m.%Y} занятий нет!".format(when)
-    else:
-        lines = ["📅 **Расписание на {:%d.%m.%Y}**".format(when)]
-        for i, les in enumerate(lessons, 1):
-            t_str = f"{les.start_time:%H:%M}–{les.end_time:%H:%M}"
-            teacher = f"\n_преп.: {les.teacher.name}_" if les.teacher else ""
-            room = f" ({les.room.building}-{les.room.number})" if les.room else ""
-            lines.append(f"{i}. `{t_str}` **{les.subject}**{room}{teacher}")
-        text = "\n".join(lines)
-    DAY_CACHE[key] = text
+        if text is None:
+            by_day = await _load_lessons(db, group_id, [when])
+            text = format_day(when, by_day.get(when, []))
+    DAY_CACHE[(group_id, when.toordinal())] = text
     return text
 
 
-async def _markdown_schedule_for_week(group_id: int, monday: date) -> str:
-    key = (group_id, monday.isoformat())
+async def _markdown_schedule_for_week(group_id: int, monday: date) -> List[str]:
+    key = (group_id, monday.toordinal())
     if key in WEEK_CACHE:
         return WEEK_CACHE[key]
+    return await _single_flight(("week", *key), lambda: _load_week(group_id, monday))
+
+
+async def _load_week(group_id: int, monday: date) -> List[str]:
+    days = [monday + timedelta(days=i) for i in range(6)]  # Пн‑Сб
+    # precomputed days in one query; lessons are queried only for the rest
+    async with get_session() as db:
+        res = await db.execute(
+            select(models.ScheduleCache.day, models.ScheduleCache.text).where(
+                models.ScheduleCache.group_id == group_id,
+                models.ScheduleCache.day >= days[0],
+                models.ScheduleCache.day <= days[-1],
+            )
+        )
+        cached: dict[date, str] = dict(res.all())
+        missing = [d for d in days if d not in cached]
+        by_day = await _load_lessons(db, group_id, missing) if missing else {}
     texts = []
-    for d in (monday + timedelta(days=i) for i in range(6)):  # Пн‑Сб
-        daily = await _markdown_schedule_for_day(group_id, d)
-        if "занятий нет" in daily:
-            continue
-        texts.append(daily)
+    for d in days:
+        if d in cached:
+            daily, has_lessons = cached[d], True
+        else:
+            lessons = by_day.get(d, [])
+            daily, has_lessons = format_day(d, lessons), bool(lessons)
+        DAY_CACHE[(group_id, d.toordinal())] = daily  # warm /today as well
+        if has_lessons:
+            texts.append(daily)
     result = "\n\n".join(texts) if texts else "ℹ️ На этой неделе занятий нет."
-    WEEK_CACHE[key] = result
-    return result
+    chunks = _split_message(result)
+    WEEK_CACHE[(group_id, monday.toordinal())] = chunks
+    return chunks
+
+
+def _dialect_insert(db: AsyncSession):
+    """``insert`` with ON CONFLICT support for the session's dialect."""
+    return pg_insert if db.get_bind().dialect.name == "postgresql" else sqlite_insert
 
 
 async def _get_or_create_user(telegram_id: int, db: AsyncSession) -> None:
@@ -122,14 +231,51 @@ async def _get_or_create_user(telegram_id: int, db: AsyncSession) -> None:
         db.add(models.User(id=telegram_id))
 
 
-async def _get_active_group(user_id: int, db: AsyncSession) -> models.Group | None:
-    q = (
-        select(models.Group)
-        .join(models.UserGroup)
-        .where(models.UserGroup.user_id == user_id, models.UserGroup.is_active == True)  # noqa: E712
-    )
-    res = await db.scalars(q)
-    return res.first()
+async def _get_active_group_id(user_id: int) -> int | None:
+    if user_id in USER_GROUP_CACHE:
+        return USER_GROUP_CACHE[user_id]
+    async with get_session() as db:
+        group_id = await db.scalar(
+            select(models.UserGroup.group_id).where(
+                models.UserGroup.user_id == user_id, models.UserGroup.is_active == True  # noqa: E712
+            )
+        )
+    if group_id is not None:
+        USER_GROUP_CACHE[user_id] = group_id
+    return group_id
+
+
+# ---------------------------------------------------------------------------
+# Outbound rate limiting ----------------------------------------------------
+# ---------------------------------------------------------------------------
+class RateLimitMiddleware(BaseRequestMiddleware):
+    """Throttle chat-bound API calls to Telegram's limits instead of hitting RetryAfter.
+
+    ~30 msg/s for the whole bot, ~20 msg/min per group chat (negative chat_id).
+    """
+
+    def __init__(self, overall_per_second: int = 30, group_per_minute: int = 20) -> None:
+        self._overall = AsyncLimiter(overall_per_second, 1)
+        self._group_per_minute = group_per_minute
+        # limiters of recently active group chats only: an entry idle for the whole
+        # 60 s window has a drained bucket, so dropping it loses no state
+        self._groups: TTLCache[int, AsyncLimiter] = TTLCache(maxsize=10_000, ttl=60)
+
+    def _group_limiter(self, chat_id: int) -> AsyncLimiter:
+        limiter = self._groups.get(chat_id) or AsyncLimiter(self._group_per_minute, 60)
+        self._groups[chat_id] = limiter  # re-set on every use: the TTL counts from the last request
+        return limiter
+
+    async def __call__(self, make_request: NextRequestMiddlewareType, bot: Bot, method: TelegramMethod):
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None:  # getUpdates, answerCallbackQuery, …
+            return await make_request(bot, method)
+        if isinstance(chat_id, int) and chat_id < 0:
+            async with self._group_limiter(chat_id):
+                async with self._overall:
+                    return await make_request(bot, method)
+        async with self._overall:
+            return await make_request(bot, method)
 
 
 # ---------------------------------------------------------------------------
@@ -180,18 +326,20 @@ async def cb_set_group(cb: types.CallbackQuery) -> None:  # noqa: D401
     group_id = int(cb.data.split(":", 1)[1])
     async with get_session() as db:
         await _get_or_create_user(cb.from_user.id, db)
-        # deactivate prev
-        await db.execute(
-            select(models.UserGroup)  # forcing load
-            .where(models.UserGroup.user_id == cb.from_user.id, models.UserGroup.is_active == True)  # noqa: E712
-            .execution_options(populate_existing=True)
+        await db.flush()  # user row must exist before the FK insert below
+        # one statement: replace the user's active group (partial unique index)
+        stmt = _dialect_insert(db)(models.UserGroup).values(
+            user_id=cb.from_user.id, group_id=group_id, is_active=True
         )
         await db.execute(
-            models.UserGroup.__table__.update()
-            .where(models.UserGroup.user_id == cb.from_user.id, models.UserGroup.is_active == True)  # noqa: E712
-            .values(is_active=False)
+            stmt.on_conflict_do_update(
+                index_elements=["user_id"],
+                index_where=models.UserGroup.is_active,
+                # selected_at is not in VALUES: set it here rather than rely on excluded.<default>
+                set_={"group_id": stmt.excluded.group_id, "selected_at": func.now()},
+            )
         )
-        db.add(models.UserGroup(user_id=cb.from_user.id, group_id=group_id, is_active=True))
+    USER_GROUP_CACHE[cb.from_user.id] = group_id
     await cb.answer("Группа сохранена!")
     await cb.message.edit_text("✅ Группа сохранена. Теперь используйте /today или /week.")
 
@@ -199,12 +347,11 @@ async def cb_set_group(cb: types.CallbackQuery) -> None:  # noqa: D401
 @router.message(Command("today"))
 async def cmd_today(msg: types.Message) -> None:
     today = date.today()
-    async with get_session() as db:
-        group = await _get_active_group(msg.from_user.id, db)
-    if not group:
+    group_id = await _get_active_group_id(msg.from_user.id)
+    if group_id is None:
         await msg.answer("Сначала выберите группу через /group ⬅️")
         return
-    text = await _markdown_schedule_for_day(group.id, today)
+    text = await _markdown_schedule_for_day(group_id, today)
     await msg.answer(text, parse_mode=ParseMode.MARKDOWN)
 
 
@@ -212,13 +359,12 @@ async def cmd_today(msg: types.Message) -> None:
 async def cmd_week(msg: types.Message) -> None:
     today = date.today()
     monday = today - timedelta(days=today.weekday())  # 0 → Monday
-    async with get_session() as db:
-        group = await _get_active_group(msg.from_user.id, db)
-    if not group:
+    group_id = await _get_active_group_id(msg.from_user.id)
+    if group_id is None:
         await msg.answer("Сначала выберите группу через /group ⬅️")
         return
-    text = await _markdown_schedule_for_week(group.id, monday)
-    await msg.answer(text, parse_mode=ParseMode.MARKDOWN)
+    for chunk in await _markdown_schedule_for_week(group_id, monday):
+        await msg.answer(chunk, parse_mode=ParseMode.MARKDOWN)
 
 
 # ---------------------------------------------------------------------------
@@ -227,20 +373,29 @@ async def cmd_week(msg: types.Message) -> None:
 
 aio_scheduler = AsyncIOScheduler()
 
-aio_scheduler.add_job(fetcher_sync, "cron", hour=5, kwargs={"db": SessionMaker()})
+
+async def _scheduled_sync() -> None:
+    """Nightly job: fresh session per run, so no connection is held between runs."""
+    async with get_session() as db:
+        await fetcher_sync(db)
 
 
 async def main() -> None:
     bot = Bot(BOT_TOKEN, parse_mode=ParseMode.HTML)
+    bot.session.middleware(RateLimitMiddleware())
     dp = Dispatcher()
     dp.include_router(router)
 
     # on‑startup events
+    aio_scheduler.add_job(_scheduled_sync, "cron", hour=5)
     aio_scheduler.start()
     await bot.delete_webhook(drop_pending_updates=True)
     try:
         await dp.start_polling(bot)
     finally:
+        shutdown_parse_pool()
+        await close_http_client()
+        await close_sheets_client()
         await engine.dispose()
 
 
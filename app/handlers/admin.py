@@ -26,22 +26,23 @@ from aiogram.enums import ParseMode
 from aiogram.filters import Command, CommandObject
 from aiogram.filters.message import DocumentFilter
 from openpyxl.utils.exceptions import InvalidFileException
+from sqlalchemy import select
 
 from services.fetcher_parser import (
     Lesson,
     SourceFileMeta,
     bulk_insert_lessons,
-    parse_excel,
+    parse_excel_async,
     sha256_path,
     upsert_source_file,
 )
 from services.fetcher_parser import sync as fetcher_sync
-from services.google_sheets_import import lessons_from_sheet
+from services.google_sheets_import import canonical_sheet_url, download_sheet, lessons_from_csv
 
 from app.bot import get_session  # session helper
 
 ADMIN_IDS = {int(x) for x in os.getenv("ADMIN_IDS", "").split(",") if x}
-GOOGLE_SHEET_RE = re.compile(r"docs.google.com/spreadsheets/d/([a-zA-Z0-9_-]+)/")
+GOOGLE_SHEET_RE = re.compile(r"docs\.google\.com/spreadsheets/d/[a-zA-Z0-9_-]+(?:[/?#]|$)")
 
 router = Router(name="admin-router")
 
@@ -52,30 +53,38 @@ router = Router(name="admin-router")
 
 def _parse_csv(path: Path) -> Sequence[Lesson]:
     """CSV → Lesson parser with predefined column names."""
-    df = pd.read_csv(path)
+    df = pd.read_csv(path, dtype="string")
     required = {"group_code", "date", "start_time", "end_time", "subject"}
     if missing := required - set(df.columns):
         raise ValueError(f"CSV missing columns: {', '.join(missing)}")
-    lessons: list[Lesson] = []
-    for row in df.itertuples(index=False):
-        lessons.append(
-            Lesson(
-                group_code=str(row.group_code).upper(),
-                date=pd.to_datetime(row.date).date(),
-                start_time=pd.to_datetime(row.start_time).time(),
-                end_time=pd.to_datetime(row.end_time).time(),
-                subject=str(row.subject),
-                teacher=getattr(row, "teacher", None),
-                room=getattr(row, "room", None),
-            )
-        )
-    return lessons
+    df = df.reindex(columns=["group_code", "date", "start_time", "end_time", "subject", "teacher", "room"])
+
+    # one vectorized conversion per column; a malformed cell raises ValueError for the whole file
+    dates = pd.to_datetime(df["date"], format="mixed").dt.date
+    start_times = pd.to_datetime(df["start_time"], format="mixed").dt.time
+    end_times = pd.to_datetime(df["end_time"], format="mixed").dt.time
+    teachers = df["teacher"].astype(object).where(df["teacher"].notna(), None)
+    rooms = df["room"].astype(object).where(df["room"].notna(), None)
+    group_codes = df["group_code"].astype(str).str.upper()
+    subjects = df["subject"].astype(str)
+
+    return [
+        Lesson(group_code=g, date=d, start_time=st, end_time=et, subject=subj, teacher=t, room=r)
+        for g, d, st, et, subj, t, r in zip(group_codes, dates, start_times, end_times, subjects, teachers, rooms)
+    ]
 
 
 async def _is_admin(user: types.User) -> bool:
     return user.id in ADMIN_IDS
 
 
+async def _already_imported(sha256: str) -> bool:
+    from db.models import SourceFile  # pylint: disable=import-error
+
+    async with get_session() as db:
+        return await db.scalar(select(SourceFile.id).where(SourceFile.sha256 == sha256)) is not None
+
+
 async def _import_lessons(lessons: Sequence[Lesson], source: SourceFileMeta) -> int:
     """Insert lessons into DB, returns inserted count."""
     async with get_session() as db:
@@ -125,11 +134,16 @@ async def admin_import_sheet(msg: types.Message, command: CommandObject) -> None
         return
     await msg.answer("⏳ Скачиваю таблицу…")
     try:
-        lessons = await lessons_from_sheet(url)
+        url = canonical_sheet_url(url)  # one SourceFile row per sheet, whatever the link looked like
+        csv_bytes, sha = await download_sheet(url)
+        if await _already_imported(sha):
+            await msg.answer("ℹ️ Таблица не изменилась с прошлого импорта.")
+            return
+        lessons = await lessons_from_csv(csv_bytes)
     except Exception as exc:  # pylint: disable=broad-except
         await msg.answer(f"❌ Ошибка: {exc}")
         return
-    count = await _import_lessons(lessons, SourceFileMeta(url=url, sha256="gsheet:" + url))
+    count = await _import_lessons(lessons, SourceFileMeta(url=url, sha256=sha))
     await msg.answer(f"✅ Импортировано занятий: {count}")
 
 
@@ -157,9 +171,9 @@ async def admin_upload(msg: types.Message) -> None:  # noqa: D401
 
     try:
         if suffix == ".xlsx":
-            lessons = parse_excel(dest)
+            lessons = await parse_excel_async(dest)
         else:
-            lessons = _parse_csv(dest)
+            lessons = await asyncio.to_thread(_parse_csv, dest)
     except (ValueError, InvalidFileException) as exc:
         await msg.answer(f"❌ Ошибка парсинга: {exc}")
         return
@@ -12,31 +12,45 @@ from __future__ import annotations
 import asyncio
 import hashlib
 import logging
+import os
 import re
 import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
 from datetime import date, datetime, time
+from itertools import islice
 from pathlib import Path
-from typing import Iterable, List, NamedTuple, Sequence
+from typing import Iterable, Iterator, List, NamedTuple, Sequence
 
 import httpx  # async requests
 from bs4 import BeautifulSoup
 from openpyxl import load_workbook
-from pydantic import BaseModel, Field, ValidationError
-from sqlalchemy import UniqueConstraint, delete, select
+from pydantic import BaseModel
+from sqlalchemy import UniqueConstraint, delete, insert, select, tuple_, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from services.schedule_cache import refresh_schedule_cache
+
 # ---- logging --------------------------------------------------------------
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
 # ---- constants ------------------------------------------------------------
 SCHEDULE_URL = "https://guu.ru/student/schedule/"
-XLSX_RE = re.compile(r"\.xlsx?$")
+XLSX_SUFFIXES = (".xlsx", ".xls")  # str.endswith, no regex per <a href>
 GROUP_RE = re.compile(r"([А-ЯA-ZЁ\-]+\d{2,3})", re.I)
 DATE_CELL_RE = re.compile(r"^(\d{1,2})[.\-/](\d{1,2})[.\-/](\d{2,4})$")
+TIME_SPLIT_RE = re.compile(r"[\u2010\u2013\u2014\-]")
+CHUNK_SIZE = 64 * 1024  # download / hashing block size
+SYNC_CONCURRENCY = 4  # files fetched/parsed in parallel by sync()
+INSERT_BATCH_SIZE = 1000  # lesson rows per executemany in bulk_insert_lessons
 
 # ---- data‑models ----------------------------------------------------------
-class Lesson(BaseModel):
+@dataclass(slots=True, frozen=True)
+class Lesson:
+    """Parsed lesson row; internal DTO, so no pydantic validation per row."""
+
     group_code: str
     date: date
     start_time: time
@@ -45,15 +59,13 @@ class Lesson(BaseModel):
     teacher: str | None = None
     room: str | None = None
 
-    class Config:
-        frozen = True
-
 
 class SourceFileMeta(BaseModel):
     url: str
     sha256: str
     semester: str | None = None
-    fetched_at: datetime = Field(default_factory=datetime.utcnow)
+    etag: str | None = None
+    last_modified: str | None = None
 
 
 class _FileLink(NamedTuple):
@@ -61,46 +73,95 @@ class _FileLink(NamedTuple):
     filename: str
 
 
+class _Downloaded(NamedTuple):
+    path: Path
+    sha256: str
+    etag: str | None
+    last_modified: str | None
+
+
+# ---- shared HTTP client ---------------------------------------------------
+# One keep-alive HTTP/2 client for all requests: TLS handshake to guu.ru is paid once.
+_HTTP: httpx.AsyncClient | None = None
+
+
+def _http() -> httpx.AsyncClient:
+    global _HTTP
+    if _HTTP is None or _HTTP.is_closed:
+        _HTTP = httpx.AsyncClient(
+            http2=True,
+            timeout=60,
+            limits=httpx.Limits(max_connections=2 * SYNC_CONCURRENCY, max_keepalive_connections=8),
+        )
+    return _HTTP
+
+
+async def close_http_client() -> None:
+    global _HTTP
+    if _HTTP is not None:
+        await _HTTP.aclose()
+        _HTTP = None
+
+
 # ---- core functions -------------------------------------------------------
 async def list_files(client: httpx.AsyncClient | None = None) -> List[_FileLink]:
     """Parse GUU schedule page and return xlsx links."""
-    own_client = client is None
-    if own_client:
-        client = httpx.AsyncClient(timeout=20)
-    try:
-        r = await client.get(SCHEDULE_URL)
-        r.raise_for_status()
-        soup = BeautifulSoup(r.text, "html.parser")
-        links = []
-        for a in soup.select("a"):
-            href: str | None = a.get("href")
-            if href and XLSX_RE.search(href):
-                links.append(_FileLink(url=httpx.URL(href, base=SCHEDULE_URL), filename=Path(href).name))
-        logger.info("Found %d xlsx links on page", len(links))
-        return links
-    finally:
-        if own_client:
-            await client.aclose()
-
-
-async def download(url: str | httpx.URL, dest_dir: Path | str | None = None) -> Path:
-    """Download a file and return local path. Destination dir defaults to tmp."""
+    client = client or _http()
+    r = await client.get(SCHEDULE_URL, timeout=20)
+    r.raise_for_status()
+    soup = BeautifulSoup(r.text, "html.parser")
+    links = []
+    for a in soup.select("a"):
+        href: str | None = a.get("href")
+        if href and href.endswith(XLSX_SUFFIXES):
+            links.append(_FileLink(url=httpx.URL(href, base=SCHEDULE_URL), filename=Path(href).name))
+    logger.info("Found %d xlsx links on page", len(links))
+    return links
+
+
+async def download(
+    url: str | httpx.URL,
+    dest_dir: Path | str | None = None,
+    client: httpx.AsyncClient | None = None,
+    *,
+    etag: str | None = None,
+    last_modified: str | None = None,
+) -> _Downloaded | None:
+    """Stream a file to disk and return its path, sha256 and HTTP validators.
+
+    Destination dir defaults to tmp. The hash is computed from the same chunks
+    that are written, so the file is neither buffered in memory nor re-read from
+    disk afterwards. With ``etag`` / ``last_modified`` from a previous download
+    the request is conditional; ``None`` is returned on ``304 Not Modified``.
+    """
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
     dest_dir = Path(dest_dir) if dest_dir else Path(tempfile.mkdtemp())
     dest_dir.mkdir(parents=True, exist_ok=True)
-    filename = Path(url).name
+    filename = Path(str(url)).name
     dest_path = dest_dir / filename
-    async with httpx.AsyncClient(timeout=60) as client:
-        r = await client.get(url)
+    h = hashlib.sha256()
+    client = client or _http()
+    async with client.stream("GET", url, headers=headers) as r:
+        if r.status_code == httpx.codes.NOT_MODIFIED:
+            logger.info("Not modified: %s", url)
+            return None
         r.raise_for_status()
-        dest_path.write_bytes(r.content)
-    logger.info("Downloaded %s → %s (%.1f KiB)", url, dest_path, dest_path.stat().st_size / 1024)
-    return dest_path
+        with dest_path.open("wb") as f:
+            async for chunk in r.aiter_bytes(CHUNK_SIZE):
+                h.update(chunk)
+                f.write(chunk)
+    logger.info("Downloaded %s → %s (%.1f KiB)", url, dest_path, dest_path.stat().st_size / 1024)
+    return _Downloaded(dest_path, h.hexdigest(), r.headers.get("ETag"), r.headers.get("Last-Modified"))
 
 
 def sha256_path(path: Path) -> str:
     h = hashlib.sha256()
     with path.open("rb") as f:
-        for chunk in iter(lambda: f.read(8192), b""):
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
             h.update(chunk)
     return h.hexdigest()
 
@@ -109,16 +170,19 @@ def sha256_path(path: Path) -> str:
 # EXCEL → Lesson records
 # ---------------------------------------------------------------------------
 
+def _hhmm(value: str) -> time:
+    h, m = value.strip().split(":")
+    return time(int(h), int(m))
+
+
 def _parse_time(cell_value: str) -> tuple[time, time]:
     """Split string like '10:30‑12:05' into two times."""
     if not cell_value:
         raise ValueError("Empty time")
-    parts = re.split(r"[\u2010\u2013\u2014\-]", str(cell_value))  # support hyphen–dash
+    parts = TIME_SPLIT_RE.split(str(cell_value).strip())  # support hyphen–dash
     if len(parts) != 2:
         raise ValueError(cell_value)
-    t1 = datetime.strptime(parts[0].strip(), "%H:%M").time()
-    t2 = datetime.strptime(parts[1].strip(), "%H:%M").time()
-    return t1, t2
+    return _hhmm(parts[0]), _hhmm(parts[1])
 
 
 def _safe_str(v) -> str:
@@ -126,24 +190,40 @@ def _safe_str(v) -> str:
 
 
 def parse_excel(path: Path) -> Sequence[Lesson]:
-    wb = load_workbook(path, data_only=True)
-    ws = wb.active  # assume first sheet contains timetable
-
-    # Attempt to detect group code row (first row that contains recognizable group code)
-    header_row_idx = None
-    for row in ws.iter_rows(min_row=1, max_row=10, values_only=True):
-        if any(GROUP_RE.search(str(cell or "")) for cell in row):
-            header_row_idx = row[0].row if hasattr(row[0], "row") else 1  # openpyxl 3.1 gives tuple of values; no .row
+    # read_only streams rows as plain value tuples instead of building cell objects;
+    # the workbook stays open while the row iterator is consumed
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        ws = wb.worksheets[0]  # assume first sheet contains timetable
+        lessons = _parse_rows(ws.iter_rows(values_only=True))
+    finally:
+        wb.close()
+    logger.info("Parsed %d lesson rows from %s", len(lessons), path.name)
+    return lessons
+
+
+def _parse_rows(rows: Iterator[tuple]) -> list[Lesson]:
+    # Attempt to detect group code row (first row that contains recognizable group code);
+    # rows before it are consumed from the same iterator, the rest is read lazily below
+    for row in islice(rows, 10):
+        # one regex scan per row: cells joined by a separator GROUP_RE can't span
+        if GROUP_RE.search("\t".join(str(cell) for cell in row if cell is not None)):
             break
-    if header_row_idx is None:
+    else:
         raise RuntimeError("Group header not found in Excel")
 
     lessons: list[Lesson] = []
 
     # For simplicity assume layout: columns: A date, B time, C subject, D teacher, E room, F group
     # Real‑world file may be different; adjust as needed.
-    for row in ws.iter_rows(min_row=header_row_idx + 1, values_only=True):
-        date_val, time_val, subject_val, teacher_val, room_val, group_val = map(_safe_str, row[:6])
+    for row in rows:
+        if len(row) < 6:
+            continue
+        # date cell stays native: openpyxl already returns datetime for date-formatted cells
+        date_val = row[0]
+        time_val, subject_val, teacher_val, room_val, group_val = map(_safe_str, row[1:6])
+        if isinstance(date_val, str):
+            date_val = date_val.strip()
         if not (date_val and time_val and subject_val and group_val):
             continue
         # Parse date
@@ -169,24 +249,43 @@ def parse_excel(path: Path) -> Sequence[Lesson]:
         except Exception as e:
             logger.debug("Skip row; bad time %s: %s", time_val, e)
             continue
-        try:
-            lessons.append(
-                Lesson(
-                    group_code=group_val.upper(),
-                    date=lesson_date,
-                    start_time=start_t,
-                    end_time=end_t,
-                    subject=subject_val,
-                    teacher=teacher_val or None,
-                    room=room_val or None,
-                )
+        lessons.append(
+            Lesson(
+                group_code=group_val.upper(),
+                date=lesson_date,
+                start_time=start_t,
+                end_time=end_t,
+                subject=subject_val,
+                teacher=teacher_val or None,
+                room=room_val or None,
             )
-        except ValidationError as e:
-            logger.debug("Validation error in row: %s", e)
-    logger.info("Parsed %d lesson rows from %s", len(lessons), path.name)
+        )
     return lessons
 
 
+_PARSE_POOL: ProcessPoolExecutor | None = None
+
+
+def _parse_pool() -> ProcessPoolExecutor:
+    global _PARSE_POOL
+    if _PARSE_POOL is None:
+        _PARSE_POOL = ProcessPoolExecutor(max_workers=os.cpu_count())
+    return _PARSE_POOL
+
+
+async def parse_excel_async(path: Path) -> Sequence[Lesson]:
+    """``parse_excel`` in a worker process, so the event loop is not blocked."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_parse_pool(), parse_excel, path)
+
+
+def shutdown_parse_pool() -> None:
+    global _PARSE_POOL
+    if _PARSE_POOL is not None:
+        _PARSE_POOL.shutdown(cancel_futures=True)
+        _PARSE_POOL = None
+
+
 # ---------------------------------------------------------------------------
 # DB integration helpers (SQLAlchemy async) ---------------------------------
 # ---------------------------------------------------------------------------
@@ -194,18 +293,38 @@ def parse_excel(path: Path) -> Sequence[Lesson]:
 
 
 async def upsert_source_file(meta: SourceFileMeta, db: AsyncSession) -> int:
-    """Insert SourceFile if sha256 unseen. Return id."""
+    """Insert or update the SourceFile row of ``meta.url``. Return id.
+
+    A known URL with new content keeps its row: sha256 (and validators) are updated.
+    The same bytes published under several URLs get one row per URL.
+    """
     from db.models import SourceFile  # pylint: disable=import-error
 
-    res = await db.execute(select(SourceFile.id).where(SourceFile.sha256 == meta.sha256))
-    existing_id = res.scalar_one_or_none()
-    if existing_id:
-        return existing_id
+    if len(meta.url) > SourceFile.url.type.length:
+        raise ValueError(f"Source URL is longer than {SourceFile.url.type.length} characters")
+    # validators are opaque server strings: an overlong one is dropped, not cut
+    # (a cut ETag never matches, the file is just downloaded in full next time)
+    etag = meta.etag if meta.etag and len(meta.etag) <= SourceFile.etag.type.length else None
+    last_modified = (
+        meta.last_modified
+        if meta.last_modified and len(meta.last_modified) <= SourceFile.last_modified.type.length
+        else None
+    )
+    semester = _clip(meta.semester, SourceFile.semester) if meta.semester else None
+
+    own_id = await db.scalar(select(SourceFile.id).where(SourceFile.url == meta.url))
+    if own_id is not None:
+        values = {"sha256": meta.sha256}
+        if meta.etag or meta.last_modified:
+            values.update(etag=etag, last_modified=last_modified)
+        await db.execute(update(SourceFile).where(SourceFile.id == own_id).values(**values))
+        return own_id
     sf = SourceFile(
         url=meta.url,
         sha256=meta.sha256,
-        semester=meta.semester,
-        added_at=meta.fetched_at,
+        semester=semester,
+        etag=etag,
+        last_modified=last_modified,
     )
     db.add(sf)
     await db.flush()
@@ -213,69 +332,108 @@ async def upsert_source_file(meta: SourceFileMeta, db: AsyncSession) -> int:
     return sf.id
 
 
+def _insert_ignore(db: AsyncSession, entity):
+    """INSERT that silently skips rows violating a unique constraint."""
+    if db.get_bind().dialect.name == "postgresql":
+        return pg_insert(entity).on_conflict_do_nothing()
+    return insert(entity).prefix_with("OR IGNORE", dialect="sqlite")
+
+
+def _clip(value: str, column) -> str:
+    """Cut ``value`` to the VARCHAR length of ``column``: one overlong cell must not fail the batch."""
+    limit = column.type.length
+    if len(value) <= limit:
+        return value
+    logger.warning("Truncated %s to %d chars: %.40s…", column.key, limit, value)
+    return value[:limit]
+
+
+def _split_room(room_name: str) -> tuple[str, str]:
+    building, _, number = room_name.partition("-") if "-" in room_name else ("", "", room_name)
+    return building, number
+
+
 async def bulk_insert_lessons(lessons: Sequence[Lesson], source_id: int, db: AsyncSession) -> None:
-    """Insert lessons; duplicates (same group/date/time/subject) are ignored."""
+    """Insert lessons; duplicates (same group/date/time/subject) are ignored.
+
+    FK ids are resolved with one query per dimension (group/room/teacher), missing
+    rooms/teachers are bulk-inserted, and lessons go in with a single executemany.
+    """
     from db.models import Group, Lesson as LessonORM, Room, Teacher  # pylint: disable=import-error
 
-    # Cache for fk lookup
-    group_cache: dict[str, int] = {}
-    room_cache: dict[str, int] = {}
-    teacher_cache: dict[str, int] = {}
-
-    async def _get_group(group_code: str) -> int:
-        if group_code in group_cache:
-            return group_cache[group_code]
-        res = await db.execute(select(Group.id).where(Group.code == group_code))
-        gid = res.scalar_one_or_none()
-        if gid is None:
-            raise RuntimeError(f"Unknown group {group_code}; import group seeds first")
-        group_cache[group_code] = gid
-        return gid
-
-    async def _get_or_create_room(room_name: str) -> int:
-        if room_name in room_cache:
-            return room_cache[room_name]
-        building, _, number = room_name.partition("-") if "-" in room_name else ("", "", room_name)
-        res = await db.execute(select(Room.id).where(Room.building == building, Room.number == number))
-        rid = res.scalar_one_or_none()
-        if rid is None:
-            room = Room(building=building, number=number)
-            db.add(room)
-            await db.flush()
-            rid = room.id
-        room_cache[room_name] = rid
-        return rid
-
-    async def _get_or_create_teacher(name: str) -> int:
-        if name in teacher_cache:
-            return teacher_cache[name]
-        res = await db.execute(select(Teacher.id).where(Teacher.name == name))
-        tid = res.scalar_one_or_none()
-        if tid is None:
-            teacher = Teacher(name=name)
-            db.add(teacher)
-            await db.flush()
-            tid = teacher.id
-        teacher_cache[name] = tid
-        return tid
-
-    for rec in lessons:
-        gid = await _get_group(rec.group_code)
-        rid = await _get_or_create_room(rec.room) if rec.room else None
-        tid = await _get_or_create_teacher(rec.teacher) if rec.teacher else None
-        obj = LessonORM(
-            group_id=gid,
-            date=rec.date,
-            start_time=rec.start_time,
-            end_time=rec.end_time,
-            subject=rec.subject,
-            teacher_id=tid,
-            room_id=rid,
-            source_id=source_id,
+    if not lessons:
+        return
+
+    group_codes = {rec.group_code for rec in lessons}
+    room_names = {rec.room for rec in lessons if rec.room}
+    teacher_names = {rec.teacher for rec in lessons if rec.teacher}
+
+    # groups must be seeded beforehand
+    res = await db.execute(select(Group.code, Group.id).where(Group.code.in_(group_codes)))
+    group_ids: dict[str, int] = {}
+    for code, gid in res.all():
+        # codes are unique per faculty only; a lesson row carries no faculty to pick one
+        if group_ids.setdefault(code, gid) != gid:
+            raise RuntimeError(f"Group code {code} exists in several faculties")
+    if unknown := group_codes - group_ids.keys():
+        raise RuntimeError(f"Unknown group {', '.join(sorted(unknown))}; import group seeds first")
+
+    # room name as written in the file → id; each distinct name is split only once
+    room_ids: dict[str, int] = {}
+    if room_names:
+        room_keys: dict[str, tuple[str, str]] = {}
+        for name in room_names:
+            building, number = _split_room(name)
+            room_keys[name] = (_clip(building, Room.building), _clip(number, Room.number))
+        wanted = set(room_keys.values())
+        res = await db.execute(
+            select(Room.building, Room.number, Room.id).where(tuple_(Room.building, Room.number).in_(wanted))
         )
-        db.add(obj)
+        key_ids = {(b, n): rid for b, n, rid in res.all()}
+        if missing_rooms := wanted - key_ids.keys():
+            res = await db.execute(
+                insert(Room).returning(Room.building, Room.number, Room.id),
+                [{"building": b, "number": n} for b, n in missing_rooms],
+            )
+            key_ids.update({(b, n): rid for b, n, rid in res.all()})
+        room_ids = {name: key_ids[key] for name, key in room_keys.items()}
+
+    # teacher name as written in the file → id
+    teacher_ids: dict[str, int] = {}
+    if teacher_names:
+        teacher_keys = {name: _clip(name, Teacher.name) for name in teacher_names}
+        wanted = set(teacher_keys.values())
+        res = await db.execute(select(Teacher.name, Teacher.id).where(Teacher.name.in_(wanted)))
+        key_ids = dict(res.all())
+        if missing_teachers := wanted - key_ids.keys():
+            res = await db.execute(
+                insert(Teacher).returning(Teacher.name, Teacher.id),
+                [{"name": name} for name in missing_teachers],
+            )
+            key_ids.update(res.all())
+        teacher_ids = {name: key_ids[key] for name, key in teacher_keys.items()}
+
+    rows = [
+        {
+            "group_id": group_ids[rec.group_code],
+            "date": rec.date,
+            "start_time": rec.start_time,
+            "end_time": rec.end_time,
+            "subject": _clip(rec.subject, LessonORM.subject),
+            "teacher_id": teacher_ids[rec.teacher] if rec.teacher else None,
+            "room_id": room_ids[rec.room] if rec.room else None,
+            "source_id": source_id,
+        }
+        for rec in lessons
+    ]
+    # Core table insert: plain executemany, no ORM bulk-insert bookkeeping per row;
+    # fixed-size batches keep each statement's parameter set bounded on large files
+    stmt = _insert_ignore(db, LessonORM.__table__)
+    for i in range(0, len(rows), INSERT_BATCH_SIZE):
+        await db.execute(stmt, rows[i : i + INSERT_BATCH_SIZE])
+    await refresh_schedule_cache(db, {(row["group_id"], row["date"]) for row in rows})
     await db.commit()
-    logger.info("Inserted %d Lesson rows (source_id=%s)", len(lessons), source_id)
+    logger.info("Inserted %d Lesson rows (source_id=%s)", len(rows), source_id)
 
 
 # ---------------------------------------------------------------------------
@@ -283,23 +441,72 @@ async def bulk_insert_lessons(lessons: Sequence[Lesson], source_id: int, db: Asy
 # ---------------------------------------------------------------------------
 
 async def sync(db: AsyncSession, *, limit: int | None = None) -> None:
-    """Main entry: fetch new xlsx files, parse and load into DB."""
-    links = await list_files()
+    """Main entry: fetch new xlsx files, parse and load into DB.
+
+    Downloads and parsing run concurrently (at most ``SYNC_CONCURRENCY`` files at
+    a time over the shared client); DB writes stay sequential because ``db`` is a
+    single session.
+    """
+    from db.models import SourceFile  # pylint: disable=import-error
+
+    sem = asyncio.Semaphore(SYNC_CONCURRENCY)
+
+    async def _process(
+        link: _FileLink,
+        client: httpx.AsyncClient,
+        validators: tuple[str | None, str | None],
+        imported: set[str],
+    ) -> tuple[_Downloaded, Sequence[Lesson] | None] | None:
+        async with sem:
+            etag, last_modified = validators
+            file = await download(link.url, client=client, etag=etag, last_modified=last_modified)
+            if file is None:  # 304: unchanged since the last sync
+                return None
+            if file.sha256 in imported:  # 200, but the same bytes are already in the DB
+                return file, None
+            return file, await parse_excel_async(file.path)
+
+    client = _http()
+    links = await list_files(client)
     if limit:
         links = links[:limit]
-    for link in links:
-        try:
-            path = await download(link.url)
-            file_hash = sha256_path(path)
-            meta = SourceFileMeta(url=str(link.url), sha256=file_hash)
-            sf_id = await upsert_source_file(meta, db)
-            # If file already exists (duplicate), skip parsing
-            if not sf_id:
+    res = await db.execute(
+        select(SourceFile.url, SourceFile.etag, SourceFile.last_modified).where(
+            SourceFile.url.in_([str(link.url) for link in links])
+        )
+    )
+    known = {url: (etag, last_modified) for url, etag, last_modified in res.all()}
+    imported = set(await db.scalars(select(SourceFile.sha256)))
+    results = await asyncio.gather(
+        *(_process(link, client, known.get(str(link.url), (None, None)), imported) for link in links),
+        return_exceptions=True,
+    )
+
+    for link, result in zip(links, results):
+        if isinstance(result, BaseException):
+            logger.error("Failed to fetch %s: %r", link.url, result)
+            continue
+        if result is None:
+            continue
+        file, lessons = result
+        url = str(link.url)
+        if lessons is None:
+            logger.info("Skip %s: sha256 %s already imported", url, file.sha256)
+        else:
+            try:
+                sf_id = await upsert_source_file(SourceFileMeta(url=url, sha256=file.sha256), db)
+                await bulk_insert_lessons(lessons, sf_id, db)
+            except Exception as e:  # pylint: disable=broad-except
+                # nothing of a failed file may reach the next commit
+                await db.rollback()
+                logger.exception("Failed to process %s: %s", url, e)
                 continue
-            lessons = parse_excel(path)
-            await bulk_insert_lessons(lessons, sf_id, db)
-        except Exception as e:  # pylint: disable=broad-except
-            logger.exception("Failed to process %s: %s", link.url, e)
+        # validators are saved only once the content is in the DB, so a failed
+        # import is downloaded in full (not answered with 304) on the next sync;
+        # bytes already imported under another URL still get this URL's own row
+        meta = SourceFileMeta(url=url, sha256=file.sha256, etag=file.etag, last_modified=file.last_modified)
+        await upsert_source_file(meta, db)
+        await db.commit()
 
 
 # ---- CLI for manual run ---------------------------------------------------
@@ -318,5 +525,6 @@ if __name__ == "__main__":
     async def _main():
         async with async_session() as session:
             await sync(session)
+        await close_http_client()
 
     asyncio.run(_main())
@@ -8,19 +8,21 @@ services/google_sheets_import.py
 1. По URL преобразуем ссылку в CSV-export (`…/export?format=csv`).
 2. Скачиваем CSV (без OAuth — работает только с публичными таблицами).
 3. Читаем в pandas.DataFrame.
-4. Конвертируем строки DataFrame → объекты Lesson (pydantic-модель, та же,
+4. Конвертируем строки DataFrame → объекты Lesson (dataclass-модель, та же,
    что используется в fetcher_parser.py).
 """
 
 from __future__ import annotations
 
+import asyncio
+import hashlib
+import io
 import re
-from datetime import date, datetime, time
+from datetime import time
 from typing import Sequence
 
 import httpx
 import pandas as pd
-from pydantic import ValidationError
 
 # берём модель Lesson из уже существующего парсера Excel
 from services.fetcher_parser import Lesson
@@ -28,27 +30,121 @@ from services.fetcher_parser import Lesson
 # ────────────────────────────────────────────────────────────────────────────────
 # Константы и утилиты
 # ────────────────────────────────────────────────────────────────────────────────
-SHEET_URL_RE = re.compile(r"/d/([a-zA-Z0-9_-]+)/")          # извлекаем ID таблицы
-TIME_RE = re.compile(r"(\\d{1,2}):(\\d{2})\\s*[–—-]\\s*(\\d{1,2}):(\\d{2})")
+CSV_COLUMNS = {"group", "group_code", "date", "time", "subject", "teacher", "room"}
+CHUNK_SIZE = 64 * 1024
+# «10:30-12:05»; якоря и ограниченные пробелы — линейное время на любом содержимом ячейки
+TIME_RE = re.compile(r"\A(\d{1,2}):(\d{2})[ \t]{0,4}[–—-][ \t]{0,4}(\d{1,2}):(\d{2})\Z")
+
+# Один keep-alive клиент на все импорты: TLS-рукопожатие с docs.google.com — один раз.
+_CLIENT: httpx.AsyncClient | None = None
+
+
+def _client() -> httpx.AsyncClient:
+    global _CLIENT
+    if _CLIENT is None or _CLIENT.is_closed:
+        _CLIENT = httpx.AsyncClient(
+            timeout=20,
+            http2=True,
+            limits=httpx.Limits(max_keepalive_connections=8, keepalive_expiry=60),
+        )
+    return _CLIENT
+
+
+async def close_client() -> None:
+    global _CLIENT
+    if _CLIENT is not None:
+        await _CLIENT.aclose()
+        _CLIENT = None
+
 
 # ────────────────────────────────────────────────────────────────────────────────
 # Вспомогательные функции
 # ────────────────────────────────────────────────────────────────────────────────
-async def _download_csv(sheet_url: str) -> str:
-    """Возвращает CSV-текст из публичной Google-таблицы."""
-    m = SHEET_URL_RE.search(sheet_url)
-    if not m:
+def _sheet_id(sheet_url: str) -> str:
+    """ID таблицы из ссылки вида …/spreadsheets/d/<id>/edit — строковыми методами, без regex."""
+    _, sep, rest = sheet_url.partition("/d/")
+    if not sep:
         raise ValueError("Некорректная ссылка на Google Sheets")
+    sheet_id = rest.split("/", 1)[0].split("?", 1)[0].split("#", 1)[0]
+    if not (sheet_id.isascii() and sheet_id.replace("_", "").replace("-", "").isalnum()):
+        raise ValueError("Некорректная ссылка на Google Sheets")
+    return sheet_id
 
-    sheet_id = m.group(1)
-    csv_url = (
-        f"https://docs.google.com/spreadsheets/d/{sheet_id}/export?format=csv"
-    )
 
-    async with httpx.AsyncClient(timeout=20) as client:
-        r = await client.get(csv_url)
+def canonical_sheet_url(sheet_url: str) -> str:
+    """Ссылка вида …/spreadsheets/d/<id> без /edit, ?usp=… и #gid=… — так она хранится в БД."""
+    return f"https://docs.google.com/spreadsheets/d/{_sheet_id(sheet_url)}"
+
+
+async def download_sheet(sheet_url: str) -> tuple[bytes, str]:
+    """Скачивает CSV публичной Google-таблицы: (сырые байты, sha256 этих байтов)."""
+    csv_url = f"{canonical_sheet_url(sheet_url)}/export?format=csv"
+
+    # тело читаем потоком и не декодируем в str — pandas разбирает байты сам;
+    # хеш считается по тем же кускам, без второго прохода
+    buf = io.BytesIO()
+    h = hashlib.sha256()
+    async with _client().stream("GET", csv_url) as r:
         r.raise_for_status()
-        return r.text
+        async for chunk in r.aiter_bytes(CHUNK_SIZE):
+            h.update(chunk)
+            buf.write(chunk)
+    return buf.getvalue(), h.hexdigest()
+
+
+def _read_csv(csv_bytes: bytes) -> pd.DataFrame:
+    # только нужные колонки и без угадывания типов: всё читается строками
+    return pd.read_csv(
+        io.BytesIO(csv_bytes),
+        engine="c",
+        dtype="string",
+        usecols=lambda c: c.lower().strip() in CSV_COLUMNS,
+    )
+
+
+def _optional_str(col: pd.Series) -> pd.Series:
+    """str для заполненных ячеек, None для пустых."""
+    return col.map(str, na_action="ignore").astype(object).where(col.notna(), None)
+
+
+def _hh_mm(half: pd.Series) -> tuple[pd.Series, pd.Series]:
+    """«ЧЧ:ММ» или «ЧЧ:ММ:СС» → (часы, минуты) строками; NaN, если вид другой.
+
+    Пробелов вокруг дефиса — не больше 4, как в TIME_RE: иначе строка уходит в TIME_RE
+    и отбрасывается там же, где и на медленном пути.
+    """
+    stripped = half.str.strip(" \t")
+    hms = stripped.str.split(":", expand=True).reindex(columns=[0, 1, 2]).astype("string")
+    digits = [hms[i].str.isdigit().fillna(False) for i in range(3)]
+    ok = (
+        (half.str.len() - stripped.str.len()).le(4).fillna(False)
+        & digits[0] & hms[0].str.len().le(2)
+        & digits[1] & hms[1].str.len().eq(2)
+        & (hms[2].isna() | (digits[2] & hms[2].str.len().eq(2)))
+    )
+    return hms[0].where(ok), hms[1].where(ok)
+
+
+def _time_parts(col: pd.Series) -> pd.DataFrame:
+    """Колонка «10:30-12:05» → 4 числовые колонки (ч, мин, ч, мин); NaN — не разобрано.
+
+    Обычный вид ячейки (ASCII-дефис, в т.ч. «10:30:00-12:05:00» из ячеек
+    формата «время») режется строковыми методами; TIME_RE — только для остатка.
+    """
+    text = col.astype("string").str.strip()
+    halves = text.str.split("-", n=1, expand=True).reindex(columns=[0, 1]).astype("string")
+    sh, sm = _hh_mm(halves[0])
+    eh, em = _hh_mm(halves[1])
+    parts = pd.concat([sh, sm, eh, em], axis=1, keys=range(4))
+
+    rest = parts.isna().any(axis=1)
+    if rest.any():
+        parts[rest] = text[rest].str.extract(TIME_RE.pattern)
+    return parts.astype(object).apply(pd.to_numeric, errors="coerce", downcast="unsigned")
+
+
+def _parse_sync(csv_bytes: bytes) -> list[Lesson]:
+    return _df_to_lessons(_read_csv(csv_bytes))
 
 
 def _df_to_lessons(df: pd.DataFrame) -> list[Lesson]:
@@ -64,10 +160,10 @@ def _df_to_lessons(df: pd.DataFrame) -> list[Lesson]:
       • teacher
       • room
     """
-    df = df.rename(columns={c.lower().strip(): c for c in df.columns})
+    df.columns = df.columns.str.lower().str.strip()
 
     # гибко принимаем group или group_code
-    if "group_code" not in df and "group" in df:
+    if "group_code" not in df.columns and "group" in df.columns:
         df = df.rename(columns={"group": "group_code"})
 
     required = {"group_code", "date", "time", "subject"}
@@ -75,45 +171,44 @@ def _df_to_lessons(df: pd.DataFrame) -> list[Lesson]:
     if missing:
         raise ValueError(f"В таблице нет колонок: {', '.join(missing)}")
 
-    lessons: list[Lesson] = []
-
-    for row in df.itertuples(index=False):
-        # время
-        match = TIME_RE.match(str(row.time))
-        if not match:
-            continue
-        sh, sm, eh, em = map(int, match.groups())
-        start_t = time(sh, sm)
-        end_t = time(eh, em)
-
-        # дата
-        raw_date = row.date
-        if isinstance(raw_date, (pd.Timestamp, datetime)):
-            lesson_date: date = raw_date.date()
-        else:
-            lesson_date = datetime.strptime(str(raw_date), "%d.%m.%Y").date()
-
-        try:
-            lessons.append(
-                Lesson(
-                    group_code=str(row.group_code).upper(),
-                    date=lesson_date,
-                    start_time=start_t,
-                    end_time=end_t,
-                    subject=str(row.subject),
-                    teacher=getattr(row, "teacher", None),
-                    room=getattr(row, "room", None),
-                )
-            )
-        except ValidationError:
-            # пропускаем строку, если не проходит валидацию pydantic
-            continue
-
-    return lessons
+    # колонки teacher/room есть всегда (NaN, если их нет в таблице)
+    df = df.reindex(columns=["group_code", "date", "time", "subject", "teacher", "room"])
+    # группы/преподаватели/аудитории повторяются из строки в строку: в category
+    # строковые операции идут по словарю уникальных значений, а не по всем N строкам
+    for col in ("group_code", "teacher", "room"):
+        df[col] = df[col].astype("string").astype("category")
+
+    # дата и время разбираются векторно, одним проходом по колонке
+    df["date"] = pd.to_datetime(df["date"], format="%d.%m.%Y", errors="coerce", cache=True)
+    parts = _time_parts(df["time"])
+    valid = (
+        df["date"].notna()
+        & df["group_code"].notna()
+        & df["subject"].notna()
+        & parts.notna().all(axis=1)
+        & (parts[0] < 24) & (parts[1] < 60) & (parts[2] < 24) & (parts[3] < 60)
+    )
+    df = df[valid]
+    # часы/минуты → списки Python int одним C-проходом (без numpy-скаляров в цикле)
+    sh, sm, eh, em = (parts.loc[valid, i].to_numpy("uint8").tolist() for i in range(4))
+
+    # struct-of-arrays: каждая колонка готовится целиком, объекты собираются в конце
+    group_codes = df["group_code"].map(str.upper)
+    dates = [ts.date() for ts in df["date"]]
+    start_times = list(map(time, sh, sm))
+    end_times = list(map(time, eh, em))
+    subjects = df["subject"].astype(str)
+    teachers = _optional_str(df["teacher"])
+    rooms = _optional_str(df["room"])
+
+    return [
+        Lesson(group_code=g, date=d, start_time=st, end_time=et, subject=subj, teacher=t, room=r)
+        for g, d, st, et, subj, t, r in zip(group_codes, dates, start_times, end_times, subjects, teachers, rooms)
+    ]
 
 
 # ────────────────────────────────────────────────────────────────────────────────
-# Публичная функция
+# Публичные функции
 # ────────────────────────────────────────────────────────────────────────────────
 async def lessons_from_sheet(sheet_url: str) -> Sequence[Lesson]:
     """
@@ -124,18 +219,20 @@ async def lessons_from_sheet(sheet_url: str) -> Sequence[Lesson]:
             \"\"\"https://docs.google.com/spreadsheets/d/1ABCdEfGhIjKlMNOpqRS_tUvwXYZ/edit#gid=0\"\"\"
         )
     """
-    csv_text = await _download_csv(sheet_url)
+    csv_bytes, _ = await download_sheet(sheet_url)
+    return await lessons_from_csv(csv_bytes)
+
 
-    # pandas 2.x дружит с TextIO, используем напрямую
-    df = pd.read_csv(pd.compat.StringIO(csv_text))  # type: ignore[arg-type]
-    return _df_to_lessons(df)
+async def lessons_from_csv(csv_bytes: bytes) -> list[Lesson]:
+    """Разбирает CSV, скачанный через :func:`download_sheet`, в рабочем потоке,
+    чтобы pandas не блокировал event loop бота."""
+    return await asyncio.to_thread(_parse_sync, csv_bytes)
 
 
 # ────────────────────────────────────────────────────────────────────────────────
 # CLI-отладка (запуск в терминале)
 # ────────────────────────────────────────────────────────────────────────────────
 if __name__ == "__main__":
-    import asyncio
     import sys
 
     if len(sys.argv) < 2:
@@ -145,5 +242,6 @@ if __name__ == "__main__":
     async def _main():
         lessons = await lessons_from_sheet(sys.argv[1])
         print("Parsed", len(lessons), "lessons")
+        await close_client()
 
     asyncio.run(_main())
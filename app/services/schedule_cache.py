@@ -0,0 +1,67 @@
+"""services/schedule_cache.py
+
+Precomputed Markdown schedules (table ``schedule_cache``).
+
+Lessons change only on import (``fetcher_parser.sync`` / admin upload), so the
+rendered text of every touched (group, day) is stored right at ingest time and
+bot handlers read it back with a primary-key lookup.
+"""
+from __future__ import annotations
+
+import logging
+from datetime import date
+from itertools import groupby
+from operator import attrgetter
+from typing import Iterable, Sequence
+
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+
+logger = logging.getLogger(__name__)
+
+
+def format_day(when: date, lessons: Sequence) -> str:
+    """Render lessons (ORM ``Lesson`` with loaded teacher/room) of a single day as Markdown."""
+    if not lessons:
+        return "📅 На {:%d.%m.%Y} занятий нет!".format(when)
+    lines = ["📅 **Расписание на {:%d.%m.%Y}**".format(when)]
+    for i, les in enumerate(lessons, 1):
+        t_str = f"{les.start_time:%H:%M}–{les.end_time:%H:%M}"
+        teacher = f"\n_преп.: {les.teacher.name}_" if les.teacher else ""
+        room = f" ({les.room.building}-{les.room.number})" if les.room else ""
+        lines.append(f"{i}. `{t_str}` **{les.subject}**{room}{teacher}")
+    return "\n".join(lines)
+
+
+def _upsert(db: AsyncSession, entity):
+    insert = pg_insert if db.get_bind().dialect.name == "postgresql" else sqlite_insert
+    stmt = insert(entity)
+    return stmt.on_conflict_do_update(index_elements=["group_id", "day"], set_={"text": stmt.excluded.text})
+
+
+async def refresh_schedule_cache(db: AsyncSession, pairs: Iterable[tuple[int, date]]) -> None:
+    """Re-render and store the schedules of the given (group_id, day) pairs."""
+    from db.models import Lesson, ScheduleCache  # pylint: disable=import-error
+
+    pairs = set(pairs)
+    if not pairs:
+        return
+    group_ids = {gid for gid, _ in pairs}
+    days = {d for _, d in pairs}
+    res = await db.scalars(
+        select(Lesson)
+        .options(selectinload(Lesson.teacher), selectinload(Lesson.room))
+        .where(Lesson.group_id.in_(group_ids), Lesson.date.in_(days))
+        .order_by(Lesson.group_id, Lesson.date, Lesson.start_time)
+    )
+    rows = [
+        {"group_id": gid, "day": d, "text": format_day(d, list(items))}
+        for (gid, d), items in groupby(res.all(), key=attrgetter("group_id", "date"))
+        if (gid, d) in pairs
+    ]
+    if rows:
+        await db.execute(_upsert(db, ScheduleCache), rows)
+    logger.info("Refreshed %d schedule_cache rows", len(rows))
@@ -1,5 +1,5 @@
 from sqlalchemy.orm import declarative_base, relationship, Mapped, mapped_column
-from sqlalchemy import Integer, String, Date, Time, DateTime, ForeignKey, Boolean, UniqueConstraint
+from sqlalchemy import Integer, String, Text, Date, Time, DateTime, ForeignKey, Boolean, Index, UniqueConstraint, func, text
 from datetime import datetime
 
 Base = declarative_base()
@@ -7,14 +7,14 @@ Base = declarative_base()
 class Faculty(Base):
     __tablename__ = "faculty"
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
-    short_name: Mapped[str] = mapped_column(String, unique=True)
+    short_name: Mapped[str] = mapped_column(String(16), unique=True)
     full_name: Mapped[str] = mapped_column(String, nullable=True)
 
 class Group(Base):
     __tablename__ = "group"
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     faculty_id: Mapped[int] = mapped_column(ForeignKey("faculty.id", ondelete="CASCADE"))
-    code: Mapped[str] = mapped_column(String)
+    code: Mapped[str] = mapped_column(String(16))
     course: Mapped[int] = mapped_column(Integer)
     faculty = relationship("Faculty", backref="groups")
     __table_args__ = (UniqueConstraint("faculty_id", "code"),)
@@ -22,22 +22,26 @@ class Group(Base):
 class Teacher(Base):
     __tablename__ = "teacher"
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
-    name: Mapped[str] = mapped_column(String, unique=True)
+    name: Mapped[str] = mapped_column(String(128), unique=True)
 
 class Room(Base):
     __tablename__ = "room"
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
-    building: Mapped[str] = mapped_column(String)
-    number: Mapped[str] = mapped_column(String)
+    building: Mapped[str] = mapped_column(String(32))
+    number: Mapped[str] = mapped_column(String(32))
     __table_args__ = (UniqueConstraint("building", "number"),)
 
 class SourceFile(Base):
     __tablename__ = "source_file"
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
-    url: Mapped[str] = mapped_column(String, unique=True)
-    sha256: Mapped[str] = mapped_column(String(64), unique=True)
-    semester: Mapped[str] = mapped_column(String, nullable=True)
-    added_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    url: Mapped[str] = mapped_column(String(512), unique=True)
+    # not unique: identical bytes may be published under several URLs (one row per URL)
+    sha256: Mapped[str] = mapped_column(String(64), index=True)
+    semester: Mapped[str] = mapped_column(String(16), nullable=True)
+    # HTTP validators of the last download → conditional GET in sync()
+    etag: Mapped[str] = mapped_column(String(256), nullable=True)
+    last_modified: Mapped[str] = mapped_column(String(64), nullable=True)
+    added_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now())
 
 class Lesson(Base):
     __tablename__ = "lesson"
@@ -46,22 +50,47 @@ class Lesson(Base):
     date: Mapped[Date] = mapped_column(Date)
     start_time: Mapped[Time] = mapped_column(Time)
     end_time: Mapped[Time] = mapped_column(Time)
-    subject: Mapped[str] = mapped_column(String)
+    subject: Mapped[str] = mapped_column(String(256))
     teacher_id: Mapped[int] = mapped_column(ForeignKey("teacher.id"), nullable=True)
     room_id: Mapped[int] = mapped_column(ForeignKey("room.id"), nullable=True)
     source_id: Mapped[int] = mapped_column(ForeignKey("source_file.id"), nullable=True)
-    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now())
+    # lazy="raise": relationships must be eager-loaded (selectinload) in queries
+    teacher = relationship("Teacher", lazy="raise")
+    room = relationship("Room", lazy="raise")
+    __table_args__ = (
+        # natural key of a lesson: re-imports hit ON CONFLICT DO NOTHING instead of duplicating
+        UniqueConstraint("group_id", "date", "start_time", "subject", name="uq_lesson_slot"),
+        # /today, /week: lessons of a group on a date (range)
+        Index("ix_lesson_group_date", "group_id", "date"),
+    )
+
+class ScheduleCache(Base):
+    """Markdown schedule of a group for one day, rendered at import time."""
+    __tablename__ = "schedule_cache"
+    group_id: Mapped[int] = mapped_column(ForeignKey("group.id", ondelete="CASCADE"), primary_key=True)
+    day: Mapped[Date] = mapped_column(Date, primary_key=True)
+    text: Mapped[str] = mapped_column(Text)
 
 class User(Base):
     __tablename__ = "user"
     id: Mapped[int] = mapped_column(Integer, primary_key=True)  # Telegram ID
-    first_seen: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    first_seen: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now())
 
 class UserGroup(Base):
     __tablename__ = "user_group"
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     user_id: Mapped[int] = mapped_column(ForeignKey("user.id", ondelete="CASCADE"))
     group_id: Mapped[int] = mapped_column(ForeignKey("group.id"))
-    selected_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    selected_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now())
     is_active: Mapped[bool] = mapped_column(Boolean, default=True)
-    __table_args__ = (UniqueConstraint("user_id", "is_active"),)
+    # at most one active group per user; also the ON CONFLICT target in cb_set_group
+    __table_args__ = (
+        Index(
+            "uq_user_active_group",
+            "user_id",
+            unique=True,
+            postgresql_where=text("is_active"),
+            sqlite_where=text("is_active"),
+        ),
+    )
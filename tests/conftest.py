@@ -0,0 +1,36 @@
+import asyncio
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+# app modules import each other as top-level packages (``services.…``), like ``python -m app.bot`` run from app/
+ROOT = Path(__file__).resolve().parent.parent
+sys.path[:0] = [str(ROOT), str(ROOT / "app")]
+
+# app.bot reads its config at import time; tests never talk to Telegram or the real DB
+os.environ.setdefault("BOT_TOKEN", "42:TEST")
+os.environ.setdefault("DB_URL", "sqlite+aiosqlite://")
+
+
+@pytest.fixture
+def run_db():
+    """Run ``main(session_maker)`` to completion on a fresh in-memory SQLite schema."""
+    from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+    from db import models
+
+    def run(main):
+        async def _run():
+            engine = create_async_engine("sqlite+aiosqlite://")
+            try:
+                async with engine.begin() as conn:
+                    await conn.run_sync(models.Base.metadata.create_all)
+                return await main(async_sessionmaker(engine, expire_on_commit=False))
+            finally:
+                await engine.dispose()
+
+        return asyncio.run(_run())
+
+    return run
@@ -1,2 +1,303 @@
+from datetime import date, time
+
+import pytest
+from sqlalchemy import create_engine, insert, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from db import models
+
+
 def test_placeholder():
     assert True
+
+
+def _session() -> Session:
+    engine = create_engine("sqlite://")
+    models.Base.metadata.create_all(engine)
+    session = Session(engine)
+    session.add_all([models.Faculty(id=1, short_name="F"), models.User(id=1), models.User(id=2)])
+    session.add_all([models.Group(id=g, faculty_id=1, code=f"G-{g}", course=1) for g in (1, 2)])
+    session.flush()
+    return session
+
+
+def test_user_group_one_active_per_user():
+    db = _session()
+    db.execute(
+        insert(models.UserGroup),
+        [
+            {"user_id": 1, "group_id": 1, "is_active": False},
+            {"user_id": 1, "group_id": 2, "is_active": False},
+            {"user_id": 1, "group_id": 1, "is_active": True},
+            {"user_id": 2, "group_id": 1, "is_active": True},  # other users are independent
+        ],
+    )
+    with pytest.raises(IntegrityError):
+        db.execute(insert(models.UserGroup).values(user_id=1, group_id=2, is_active=True))
+
+
+# ---------------------------------------------------------------------------
+# fetcher_parser.bulk_insert_lessons
+# ---------------------------------------------------------------------------
+def _lesson(day: int, hour: int, subject: str = "Math", teacher=None, room=None, group: str = "AB-21"):
+    from services.fetcher_parser import Lesson
+
+    return Lesson(group, date(2025, 9, day), time(hour), time(hour, 45), subject, teacher, room)
+
+
+async def _seed_groups(db, *codes_by_faculty):
+    db.add_all([models.Faculty(id=1, short_name="F1"), models.Faculty(id=2, short_name="F2")])
+    db.add_all(
+        [models.Group(faculty_id=fid, code=code, course=1) for fid, codes in enumerate(codes_by_faculty, 1) for code in codes]
+    )
+    await db.commit()
+
+
+def test_bulk_insert_lessons_resolves_fks_in_batches(run_db, monkeypatch):
+    from services import fetcher_parser
+
+    monkeypatch.setattr(fetcher_parser, "INSERT_BATCH_SIZE", 2)
+    lessons = [
+        _lesson(1, 9, teacher="Ivanov", room="A-101"),
+        _lesson(1, 11, teacher="Petrov", room="A-101"),
+        _lesson(2, 9, teacher="Ivanov", room="202"),
+        _lesson(2, 11, room="B-7"),
+        _lesson(3, 9),
+    ]
+
+    async def main(sessions):
+        async with sessions() as db:
+            await _seed_groups(db, ["AB-21"])
+            db.add_all([models.Teacher(name="Ivanov"), models.Room(building="A", number="101")])
+            await db.commit()
+            await fetcher_parser.bulk_insert_lessons(lessons, None, db)
+            await fetcher_parser.bulk_insert_lessons(lessons, None, db)  # re-import: uq_lesson_slot
+            res = await db.execute(
+                select(models.Lesson.date, models.Lesson.start_time, models.Teacher.name, models.Room.building, models.Room.number)
+                .outerjoin(models.Teacher, models.Lesson.teacher_id == models.Teacher.id)
+                .outerjoin(models.Room, models.Lesson.room_id == models.Room.id)
+                .order_by(models.Lesson.date, models.Lesson.start_time)
+            )
+            rows = res.all()
+            teachers = (await db.scalars(select(models.Teacher.name).order_by(models.Teacher.name))).all()
+            rooms = (await db.execute(select(models.Room.building, models.Room.number).order_by(models.Room.id))).all()
+            return rows, teachers, rooms
+
+    rows, teachers, rooms = run_db(main)
+    assert [tuple(row)[2:] for row in rows] == [
+        ("Ivanov", "A", "101"),
+        ("Petrov", "A", "101"),
+        ("Ivanov", "", "202"),
+        (None, "B", "7"),
+        (None, None, None),
+    ]
+    assert teachers == ["Ivanov", "Petrov"]
+    assert rooms[0] == ("A", "101")  # existing row reused, not re-inserted
+    assert sorted(rooms[1:]) == [("", "202"), ("B", "7")]
+
+
+def test_bulk_insert_lessons_rejects_ambiguous_group_code(run_db):
+    from services.fetcher_parser import bulk_insert_lessons
+
+    async def main(sessions):
+        async with sessions() as db:
+            await _seed_groups(db, ["AB-21"], ["AB-21"])
+            await bulk_insert_lessons([_lesson(1, 9)], None, db)
+
+    with pytest.raises(RuntimeError, match="several faculties"):
+        run_db(main)
+
+
+# ---------------------------------------------------------------------------
+# schedule_cache
+# ---------------------------------------------------------------------------
+def test_refresh_schedule_cache_renders_and_updates(run_db, monkeypatch):
+    from sqlalchemy.orm import selectinload
+
+    from app import bot
+    from services.schedule_cache import format_day, refresh_schedule_cache
+
+    day1, day2 = date(2025, 9, 1), date(2025, 9, 2)
+
+    async def cached(db):
+        res = await db.execute(select(models.ScheduleCache.group_id, models.ScheduleCache.day, models.ScheduleCache.text))
+        return {(gid, d): text for gid, d, text in res.all()}
+
+    async def main(sessions):
+        async with sessions() as db:
+            await _seed_groups(db, ["AB-21", "CD-22"])
+            db.add(models.Teacher(id=1, name="Ivanov"))
+            db.add_all(
+                [
+                    models.Lesson(group_id=1, date=day1, start_time=time(11), end_time=time(12), subject="Phys", teacher_id=1),
+                    models.Lesson(group_id=1, date=day1, start_time=time(9), end_time=time(10), subject="Math"),
+                    models.Lesson(group_id=1, date=day2, start_time=time(9), end_time=time(10), subject="Chem"),
+                    models.Lesson(group_id=2, date=day1, start_time=time(9), end_time=time(10), subject="Law"),
+                ]
+            )
+            await db.commit()
+            # (2, day1) is not asked for and must not be rendered
+            await refresh_schedule_cache(db, [(1, day1), (1, day2)])
+            await db.commit()
+            first = await cached(db)
+            lessons = (
+                await db.scalars(
+                    select(models.Lesson)
+                    .options(selectinload(models.Lesson.teacher), selectinload(models.Lesson.room))
+                    .where(models.Lesson.group_id == 1, models.Lesson.date == day1)
+                    .order_by(models.Lesson.start_time)
+                )
+            ).all()
+            expected = format_day(day1, lessons)
+
+            lessons[0].subject = "Algebra"
+            await db.commit()
+            await refresh_schedule_cache(db, [(1, day1)])
+            await db.commit()
+            second = await cached(db)
+
+        # read path: /today serves the stored text
+        monkeypatch.setattr(bot, "SessionMaker", sessions)
+        bot.DAY_CACHE.clear()
+        served = await bot._load_day(1, day1)
+        bot.DAY_CACHE.clear()
+        return first, expected, second, served
+
+    first, expected, second, served = run_db(main)
+    assert set(first) == {(1, day1), (1, day2)}
+    assert first[(1, day1)] == expected
+    assert "1. `09:00–10:00` **Math**" in expected and "_преп.: Ivanov_" in expected
+    assert "Chem" in first[(1, day2)] and "Math" not in first[(1, day2)]
+    assert "**Algebra**" in second[(1, day1)] and "Math" not in second[(1, day1)]
+    assert second[(1, day2)] == first[(1, day2)]
+    assert served == second[(1, day1)]
+
+
+# ---------------------------------------------------------------------------
+# bot.cb_set_group
+# ---------------------------------------------------------------------------
+def test_cb_set_group_replaces_active_group(run_db, monkeypatch):
+    from types import SimpleNamespace
+    from unittest.mock import AsyncMock
+
+    from app import bot
+
+    def callback(group_id: int):
+        message = SimpleNamespace(edit_text=AsyncMock())
+        return SimpleNamespace(data=f"setgrp:{group_id}", from_user=SimpleNamespace(id=7), answer=AsyncMock(), message=message)
+
+    async def main(sessions):
+        async with sessions() as db:
+            await _seed_groups(db, ["AB-21", "CD-22"])
+        monkeypatch.setattr(bot, "SessionMaker", sessions)
+        await bot.cb_set_group(callback(1))
+        await bot.cb_set_group(callback(2))
+        async with sessions() as db:
+            res = await db.execute(select(models.UserGroup.group_id, models.UserGroup.is_active, models.UserGroup.selected_at))
+            return res.all()
+
+    rows = run_db(main)
+    assert len(rows) == 1
+    group_id, is_active, selected_at = rows[0]
+    assert (group_id, is_active) == (2, True)
+    assert selected_at is not None
+    assert bot.USER_GROUP_CACHE.pop(7) == 2
+
+
+# ---------------------------------------------------------------------------
+# fetcher_parser.sync
+# ---------------------------------------------------------------------------
+def test_sync_skips_not_modified_and_known_content(run_db, monkeypatch):
+    from pathlib import Path
+
+    from services import fetcher_parser as fp
+
+    served = {  # url → (sha256, etag); "a" is answered with 304 once its etag is known
+        "https://guu.ru/a.xlsx": ("sha-a", '"a1"'),
+        "https://guu.ru/b.xlsx": ("sha-a", '"b1"'),  # same bytes as a.xlsx under another URL
+        "https://guu.ru/c.xlsx": ("sha-c", '"c1"'),
+    }
+    sent_etags, parsed = [], []
+
+    async def list_files(client=None):
+        return [fp._FileLink(url, Path(url).name) for url in served]
+
+    async def download(url, dest_dir=None, client=None, *, etag=None, last_modified=None):
+        sent_etags.append((url, etag))
+        sha, new_etag = served[url]
+        if etag == new_etag:
+            return None
+        return fp._Downloaded(Path(url), sha, new_etag, None)
+
+    async def parse_excel_async(path):
+        parsed.append(path.name)
+        return [_lesson(1, 9, subject=path.name)]
+
+    monkeypatch.setattr(fp, "_http", lambda: None)
+    monkeypatch.setattr(fp, "list_files", list_files)
+    monkeypatch.setattr(fp, "download", download)
+    monkeypatch.setattr(fp, "parse_excel_async", parse_excel_async)
+
+    async def main(sessions):
+        async with sessions() as db:
+            await _seed_groups(db, ["AB-21"])
+            db.add(models.SourceFile(url="https://guu.ru/a.xlsx", sha256="sha-a", etag='"a1"'))
+            await db.commit()
+            await fp.sync(db)
+            first_etags = list(sent_etags)
+            sent_etags.clear()
+            await fp.sync(db)
+            res = await db.execute(select(models.SourceFile.url, models.SourceFile.sha256, models.SourceFile.etag))
+            files = sorted(res.all())
+            subjects = (await db.scalars(select(models.Lesson.subject))).all()
+        return first_etags, files, subjects
+
+    first_etags, files, subjects = run_db(main)
+    assert first_etags == [
+        ("https://guu.ru/a.xlsx", '"a1"'),
+        ("https://guu.ru/b.xlsx", None),
+        ("https://guu.ru/c.xlsx", None),
+    ]
+    assert parsed == ["c.xlsx"]  # 304 and already-imported bytes are never parsed
+    assert files == [
+        ("https://guu.ru/a.xlsx", "sha-a", '"a1"'),
+        ("https://guu.ru/b.xlsx", "sha-a", '"b1"'),
+        ("https://guu.ru/c.xlsx", "sha-c", '"c1"'),
+    ]
+    assert subjects == ["c.xlsx"]
+    # second run: every URL, including the duplicate one, is fetched conditionally
+    assert sent_etags == [(url, etag) for url, (_, etag) in served.items()]
+
+
+def test_bulk_insert_lessons_truncates_overlong_cells(run_db):
+    from services.fetcher_parser import bulk_insert_lessons
+
+    subject, teacher = "S" * 300, "T" * 200
+
+    async def main(sessions):
+        async with sessions() as db:
+            await _seed_groups(db, ["AB-21"])
+            await bulk_insert_lessons([_lesson(1, 9, subject=subject, teacher=teacher, room="A-" + "9" * 40)], None, db)
+            res = await db.execute(
+                select(models.Lesson.subject, models.Teacher.name, models.Room.number)
+                .join(models.Teacher, models.Lesson.teacher_id == models.Teacher.id)
+                .join(models.Room, models.Lesson.room_id == models.Room.id)
+            )
+            return res.one()
+
+    stored_subject, stored_teacher, stored_number = run_db(main)
+    assert stored_subject == subject[:256]
+    assert stored_teacher == teacher[:128]
+    assert stored_number == "9" * 32
+
+
+def test_upsert_source_file_rejects_overlong_url(run_db):
+    from services.fetcher_parser import SourceFileMeta, upsert_source_file
+
+    async def main(sessions):
+        async with sessions() as db:
+            await upsert_source_file(SourceFileMeta(url="https://example.com/" + "x" * 600, sha256="0" * 64), db)
+
+    with pytest.raises(ValueError, match="longer than 512"):
+        run_db(main)
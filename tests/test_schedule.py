@@ -1,2 +1,120 @@
+from datetime import date, time
+
+import pytest
+
+from services.google_sheets_import import TIME_RE, _parse_sync, _sheet_id, canonical_sheet_url
+
+
 def test_placeholder_schedule():
     assert True
+
+
+@pytest.mark.parametrize("cell", ["10:30-12:05", "10:30 – 12:05", "10:30—12:05"])
+def test_time_re_matches_dash_variants(cell):
+    m = TIME_RE.fullmatch(cell)
+    assert m is not None
+    assert m.groups() == ("10", "30", "12", "05")
+
+
+@pytest.mark.parametrize(
+    "cell",
+    [
+        "10:30" + " " * 10_000 + "-12:05",
+        "10:30 -" + "\t" * 10_000,
+        "10:30-12:05 and more",
+        " " * 10_000 + "x",
+    ],
+)
+def test_time_re_rejects_long_or_trailing_junk(cell):
+    assert TIME_RE.fullmatch(cell) is None
+
+
+@pytest.mark.parametrize(
+    "url",
+    [
+        "https://docs.google.com/spreadsheets/d/1AbC-d_E/edit#gid=0",
+        "https://docs.google.com/spreadsheets/d/1AbC-d_E/",
+        "https://docs.google.com/spreadsheets/d/1AbC-d_E?usp=sharing",
+    ],
+)
+def test_sheet_id_from_url(url):
+    assert _sheet_id(url) == "1AbC-d_E"
+
+
+@pytest.mark.parametrize(
+    "url",
+    [
+        "https://example.com/sheet",
+        "https://docs.google.com/spreadsheets/d//edit",
+        "https://docs.google.com/spreadsheets/d/1АбВ٣/edit",
+    ],
+)
+def test_sheet_id_rejects_bad_url(url):
+    with pytest.raises(ValueError):
+        _sheet_id(url)
+
+
+def test_csv_headers_are_case_insensitive():
+    csv = (
+        " Group_Code ,DATE,Time,Subject,Teacher\n"
+        "ab-21,01.09.2025,10:30-12:05,Math,Ivanov\n"
+    ).encode()
+    [lesson] = _parse_sync(csv)
+    assert lesson.group_code == "AB-21"
+    assert lesson.date == date(2025, 9, 1)
+    assert (lesson.start_time, lesson.end_time) == (time(10, 30), time(12, 5))
+    assert lesson.teacher == "Ivanov"
+    assert lesson.room is None
+
+
+def test_csv_time_cells_with_seconds_and_dash_variants():
+    csv = (
+        "group,date,time,subject\n"
+        "AB-21,01.09.2025,10:30:00-12:05:00,Math\n"
+        "AB-21,01.09.2025,12:20 – 13:55,Phys\n"
+        "AB-21,01.09.2025,25:00-26:00,Bad\n"
+        "AB-21,01.09.2025,14:10" + " " * 50 + "-" + " " * 50 + "15:45,Spaced\n"  # over TIME_RE's [ \t]{0,4}
+        "AB-21,01.09.2025,16:00    -    17:35,Spaced4\n"
+    ).encode()
+    lessons = _parse_sync(csv)
+    assert [(les.start_time, les.end_time) for les in lessons] == [
+        (time(10, 30), time(12, 5)),
+        (time(12, 20), time(13, 55)),
+        (time(16, 0), time(17, 35)),
+    ]
+
+
+def test_csv_empty_teacher_and_room_cells_become_none():
+    csv = (
+        "group,date,time,subject,teacher,room\n"
+        "AB-21,01.09.2025,10:30-12:05,Math,,\n"
+        "AB-21,02.09.2025,10:30-12:05,Math,Ivanov,A-101\n"
+    ).encode()
+    first, second = _parse_sync(csv)
+    assert (first.teacher, first.room) == (None, None)
+    assert (second.teacher, second.room) == ("Ivanov", "A-101")
+
+
+@pytest.mark.parametrize(
+    "text, n_chunks",
+    [
+        ("short schedule", 1),
+        ("\n".join(f"{i}. `09:00–10:30` **Lesson {i}**" for i in range(400)), 4),  # many lines
+        ("x" * 9000, 3),  # one line over the limit
+        ("head\n" + "y" * 5000 + "\ntail", 3),
+    ],
+    ids=["under-limit", "multi-line", "long-line", "long-line-between"],
+)
+def test_split_message(text, n_chunks):
+    from app.bot import TG_MESSAGE_LIMIT, _split_message
+
+    chunks = _split_message(text)
+    assert len(chunks) == n_chunks
+    assert all(len(chunk) <= TG_MESSAGE_LIMIT for chunk in chunks)
+    # nothing lost or reordered: only line breaks at chunk borders disappear
+    assert "".join(chunks).replace("\n", "") == text.replace("\n", "")
+
+
+def test_canonical_sheet_url_drops_long_query():
+    url = "https://docs.google.com/spreadsheets/d/1AbC-d_E/edit?usp=sharing" + "&x=1" * 200 + "#gid=0"
+    assert canonical_sheet_url(url) == "https://docs.google.com/spreadsheets/d/1AbC-d_E"